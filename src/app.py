@@ -1,89 +1,273 @@
 # app.py
+import json
+import base64
+import glob
+import io
+import os
+import re
+import tempfile
+
 import numpy as np
 from pathlib import Path
 
 import streamlit as st
-import rioxarray
 import folium
-from streamlit_folium import st_folium
-import matplotlib.cm as cm
+import zarr
+from PIL import Image
+
+# Raster -> RGBA pipeline, shared with src/buildEventsZarr.py
+from eventRgba import MAX_SIZE, VMIN_PCT, VMAX_PCT, event_to_rgba
 
 # ------------------ STREAMLIT PAGE CONFIG ------------------
 st.set_page_config(page_title="Flood events dashboard", layout="wide")
 st.title(" Flood events dashboard")
 
-# ------------------ DATA: LIST TIF FILES -------------------
-flood_dir = Path("data/one")
-tif_files = sorted(flood_dir.glob("*.tif"))
+# In-memory cache sizes (least recently used entries are evicted first).
+# RGBA arrays are up to MAX_SIZE^2 * 4 bytes (~36 MB) each; the PNG data
+# URIs and rendered maps (one per event and opacity step) are far smaller.
+RGBA_CACHE_ENTRIES = 4
+PNG_CACHE_ENTRIES = 16
+MAP_CACHE_ENTRIES = 32
 
-if not tif_files:
-    st.error("No .tif files found in data/floods/")
-    st.stop()
+# On-disk cache of colour-mapped events (survives app restarts)
+CACHE_DIR = Path("data/cache")
 
-file_labels = [f.name for f in tif_files]
-selected_label = st.sidebar.selectbox("Select flood event", file_labels)
-selected_file = next(f for f in tif_files if f.name == selected_label)
+# Folder with one GeoTIFF per event
+FLOOD_DIR = Path("data/one")
 
-st.sidebar.write("Selected file:")
-st.sidebar.code(str(selected_file), language="bash")
+# Pre-rendered RGBA events (built by src/buildEventsZarr.py).
+# Up-to-date entries are read from here; other events fall back to
+# colour-mapping their GeoTIFF on request.
+EVENTS_ZARR = Path("data/events.zarr")
 
-# ------------------ READ RASTER WITH RIOXARRAY -------------
-# Open raster (assumed single band)
-da = rioxarray.open_rasterio(selected_file)
-da = da.squeeze("band", drop=True)  # remove band dimension
 
-# If CRS is missing, set it manually (your EFAS files are in EPSG:27704)
-if da.rio.crs is None:
-    da = da.rio.write_crs("EPSG:27704")
+# ------------------ RGBA DISK CACHE ------------------------
+def _cache_stem(event_key, source_mtime_ns, max_size, vmin_pct, vmax_pct):
+    """Cache file stem, unique per event version and display settings."""
+    return CACHE_DIR / (
+        f"{event_key}__{source_mtime_ns}__{max_size}__p{vmin_pct}-{vmax_pct}"
+    )
 
-# Optional: light downsampling for faster display if very large
-max_size = 3000  # maximum pixels in width/height
-ny, nx = da.sizes["y"], da.sizes["x"]
-scale = max(ny, nx) / max_size
-if scale > 1:
-    factor = int(np.ceil(scale))
-    da = da.coarsen(y=factor, x=factor, boundary="trim").mean()
 
-# ------------------ REPROJECT TO WGS84 (LAT/LON) -----------
-da_ll = da.rio.reproject("EPSG:4326")
+def prune_cached_versions(event_key, source_mtime_ns):
+    """Delete the cache files of older versions (mtimes) of an event."""
+    pattern = re.compile(
+        re.escape(event_key) + r"__(-?\d+)__\d+__p[^_]+\.(npy|json)"
+    )
+    for f in CACHE_DIR.glob(glob.escape(event_key) + "__*"):
+        m = pattern.fullmatch(f.name)
+        if m and int(m.group(1)) != source_mtime_ns:
+            f.unlink(missing_ok=True)
 
-# Get data as float, apply nodata mask
-nodata = da_ll.rio.nodata
-arr = da_ll.values.astype(float)
 
-if nodata is not None:
-    arr[arr == nodata] = np.nan
+def load_cached_rgba(stem):
+    """
+    Return (rgba, bounds, info) from the disk cache, or None on a miss.
 
-# Treat non-positive values as "no flood"
-arr[arr <= 0] = np.nan
+    The array is read in full: build_rgba() is st.cache_data, which
+    pickles its result, so a memory map would not be shared anyway.
+    """
+    rgba_path = stem.with_name(stem.name + ".npy")
+    meta_path = stem.with_name(stem.name + ".json")
+    if not (rgba_path.exists() and meta_path.exists()):
+        return None
 
-# ------------------ INTENSITY STRETCH & COLORMAP -----------
-valid = arr[~np.isnan(arr)]
-if valid.size == 0:
-    st.warning("This raster has no valid (non-nodata) flood pixels.")
+    try:
+        rgba = np.load(rgba_path)
+        meta = json.loads(meta_path.read_text())
+    except FileNotFoundError:
+        # Pruned by another session in the meantime
+        return None
+    return rgba, tuple(meta["bounds"]), meta["info"]
+
+
+def _atomic_write(path, write):
+    """
+    Call `write(fileobj)` on a temp file next to `path`, then rename it
+    into place, so readers never see a half-written file.
+    """
+    fd, tmp = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as fh:
+            write(fh)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def save_cached_rgba(stem, rgba, bounds, info):
+    """
+    Write the RGBA array (.npy) and its bounds/info (.json) to the cache.
+
+    The .json goes last: load_cached_rgba() only hits once both exist.
+    """
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    meta = json.dumps({"bounds": list(bounds), "info": info}).encode()
+    _atomic_write(
+        stem.with_name(stem.name + ".npy"), lambda fh: np.save(fh, rgba)
+    )
+    _atomic_write(stem.with_name(stem.name + ".json"), lambda fh: fh.write(meta))
+
+
+# ------------------ RASTER → RGBA (CACHED) -----------------
+@st.cache_data(show_spinner=False, max_entries=RGBA_CACHE_ENTRIES)
+def build_rgba(
+    event_key: str,
+    file_paths: tuple[str, ...],
+    source_mtime_ns: int,
+    max_size: int,
+    vmin_pct: float,
+    vmax_pct: float,
+) -> tuple[np.ndarray, tuple, dict]:
+    """
+    Read, downsample, reproject and colour-map an event raster.
+
+    Cached on its arguments, so UI-only reruns (opacity slider, map pan)
+    reuse the result instead of re-reading the GeoTIFF. Results are also
+    persisted under CACHE_DIR, so a restarted app skips the pipeline.
+    `source_mtime_ns` makes an edited GeoTIFF a new cache entry; the disk
+    files of its previous versions are deleted once the new one is saved.
+
+    Returns (rgba_uint8, (miny, minx, maxy, maxx), info). `rgba_uint8` is
+    None when the raster has no valid flood pixels.
+    """
+    stem = _cache_stem(event_key, source_mtime_ns, max_size, vmin_pct, vmax_pct)
+    cached = load_cached_rgba(stem)
+    if cached is not None:
+        return cached
+
+    rgba, bounds, info = event_to_rgba(file_paths[0], max_size, vmin_pct, vmax_pct)
+    if rgba is not None:
+        save_cached_rgba(stem, rgba, bounds, info)
+        prune_cached_versions(event_key, source_mtime_ns)
+
+    return rgba, bounds, info
+
+
+# ------------------ PRE-RENDERED EVENTS (ZARR) -------------
+@st.cache_resource(show_spinner=False)
+def open_events_store(path: str):
+    """Open the pre-rendered events Zarr store once per process."""
+    return zarr.open_group(path, mode="r")
+
+
+@st.cache_data(show_spinner=False, max_entries=RGBA_CACHE_ENTRIES)
+def load_zarr_event(
+    event_key: str, source_mtime_ns: int
+) -> tuple[np.ndarray, tuple, dict]:
+    """
+    Read one pre-rendered event from the Zarr store.
+
+    `source_mtime_ns` (from the entry's attrs) keys the cache, so a rebuilt
+    entry is read again. Returns (rgba_uint8, (miny, minx, maxy, maxx),
+    info), like build_rgba().
+    """
+    z = open_events_store(str(EVENTS_ZARR))[event_key]
+    return z[:], tuple(z.attrs["bounds"]), dict(z.attrs["info"])
+
+
+# ------------------ RGBA → PNG DATA URI (CACHED) -----------
+@st.cache_data(show_spinner=False, max_entries=PNG_CACHE_ENTRIES)
+def rgba_to_data_uri(event_key: str, _rgba) -> str:
+    """
+    Encode the RGBA overlay as a base64 PNG data URI, once per event.
+
+    Folium embeds data URIs as-is, so it never re-encodes the array.
+    `_rgba` is not hashed, the event key (with its source mtime)
+    already identifies it.
+    """
+    buf = io.BytesIO()
+    Image.fromarray(np.ascontiguousarray(_rgba)).save(
+        buf, format="PNG", compress_level=1
+    )
+    return "data:image/png;base64," + base64.b64encode(buf.getvalue()).decode()
+
+
+# ------------------ FOLIUM MAP → HTML (CACHED) -------------
+@st.cache_resource(show_spinner=False, max_entries=MAP_CACHE_ENTRIES)
+def render_map_html(
+    event_key: str, overlay_opacity: float, _image_uri: str, bounds
+) -> str:
+    """
+    Build the Folium map for one event and render it to HTML once.
+
+    Keyed on (event_key, overlay_opacity); `_image_uri` (the PNG data URI
+    of the overlay) is not hashed, the event key already identifies it.
+    """
+    miny, minx, maxy, maxx = bounds
+    center_lat = (miny + maxy) / 2
+    center_lon = (minx + maxx) / 2
+
+    # Create the base map (Leaflet)
+    m = folium.Map(location=[center_lat, center_lon], zoom_start=6)
+    folium.TileLayer("OpenStreetMap").add_to(m)
+
+    # Add flood intensity overlay (only flood pixels visible)
+    image_overlay = folium.raster_layers.ImageOverlay(
+        name="Flood intensity",
+        image=_image_uri,  # pre-encoded RGBA PNG with transparency
+        bounds=[[miny, minx], [maxy, maxx]],  # south-west, north-east (lat, lon)
+        opacity=overlay_opacity,  # global opacity multiplier
+        interactive=True,
+        cross_origin=False,
+    )
+
+    image_overlay.add_to(m)
+    folium.LayerControl().add_to(m)
+
+    return m.get_root().render()
+
+
+# ------------------ DATA: LIST EVENTS ----------------------
+tif_files = {f.stem: f for f in sorted(FLOOD_DIR.glob("*.tif"))}
+store = open_events_store(str(EVENTS_ZARR)) if EVENTS_ZARR.exists() else None
+stored = set(store.array_keys()) if store is not None else set()
+
+event_keys = sorted(set(tif_files) | stored)
+if not event_keys:
+    st.error(f"No flood events found in {FLOOD_DIR}/ or {EVENTS_ZARR}")
     st.stop()
 
-# Percentile stretch to enhance contrast
-vmin = float(np.nanpercentile(valid, 2))
-vmax = float(np.nanpercentile(valid, 98))
+selected_event = st.sidebar.selectbox("Select flood event", event_keys)
+selected_file = tif_files.get(selected_event)
 
-# Normalise to 0–1
-norm = (arr - vmin) / (vmax - vmin)
-norm = np.clip(norm, 0, 1)
+# Use the store only if its entry is at least as new as the GeoTIFF
+source_mtime_ns = selected_file.stat().st_mtime_ns if selected_file else -1
+stored_mtime_ns = None
+if selected_event in stored:
+    stored_mtime_ns = store[selected_event].attrs.get("source_mtime_ns", -1)
 
-# Choose a multicolour intensity colormap (similar to your example)
-cmap = cm.get_cmap("turbo")  # try 'jet', 'plasma', 'viridis' if you prefer
-rgba = cmap(norm)            # shape (ny, nx, 4), values in [0,1]
+if stored_mtime_ns is not None and stored_mtime_ns >= source_mtime_ns:
+    # Pre-rendered: a single chunked read from the store
+    st.sidebar.write("Selected event:")
+    st.sidebar.code(f"{EVENTS_ZARR}/{selected_event}", language="bash")
 
-# Alpha: 0 where no flood (nan), 1 where flooded
-alpha_mask = ~np.isnan(arr)
-rgba[..., 3] = np.where(alpha_mask, rgba[..., 3], 0.0)
+    event_version = stored_mtime_ns
+    rgba, (miny, minx, maxy, maxx), info = load_zarr_event(
+        selected_event, stored_mtime_ns
+    )
+else:
+    # New, changed or flood-free event: colour-map the GeoTIFF
+    st.sidebar.write("Selected file:")
+    st.sidebar.code(str(selected_file), language="bash")
 
-# ------------------ BUILD EUROPE MAP WITH FOLIUM -----------
-minx, miny, maxx, maxy = da_ll.rio.bounds()
-center_lat = (miny + maxy) / 2
-center_lon = (minx + maxx) / 2
+    # ------------------ READ + COLOURISE RASTER ------------
+    event_version = source_mtime_ns
+    rgba, (miny, minx, maxy, maxx), info = build_rgba(
+        selected_event,
+        (str(selected_file),),
+        source_mtime_ns,
+        MAX_SIZE,
+        VMIN_PCT,
+        VMAX_PCT,
+    )
 
+if rgba is None:
+    st.warning("This raster has no valid (non-nodata) flood pixels.")
+    st.stop()
+
+# ------------------ BUILD EUROPE MAP WITH FOLIUM -----------
 # Opacity slider in the UI
 default_opacity = 0.8
 overlay_opacity = st.sidebar.slider(
@@ -92,31 +276,25 @@ overlay_opacity = st.sidebar.slider(
 
 st.subheader("Flood intensity in European context")
 
-# Create the base map (Leaflet)
-m = folium.Map(location=[center_lat, center_lon], zoom_start=6)
-folium.TileLayer("OpenStreetMap").add_to(m)
-
-# Add flood intensity overlay (only flood pixels visible)
-image_overlay = folium.raster_layers.ImageOverlay(
-    name="Flood intensity",
-    image=rgba,  # RGBA array with transparency
-    bounds=[[miny, minx], [maxy, maxx]],  # south-west, north-east (lat, lon)
-    opacity=overlay_opacity,  # global opacity multiplier
-    interactive=True,
-    cross_origin=False,
+# Snap to the slider step so repeated values hit the same cache entry
+opacity_bucket = round(round(overlay_opacity / 0.05) * 0.05, 2)
+render_key = f"{selected_event}@{event_version}"
+image_uri = rgba_to_data_uri(render_key, rgba)
+html = render_map_html(
+    render_key,
+    opacity_bucket,
+    image_uri,
+    (miny, minx, maxy, maxx),
 )
 
-image_overlay.add_to(m)
-folium.LayerControl().add_to(m)
-
-# Display map in Streamlit
-st_folium(m, width=1000, height=700)
+# Display pre-rendered map in Streamlit
+st.iframe(html, width=1000, height=700)
 
 # ------------------ SIDEBAR: RASTER STATS ------------------
 st.sidebar.markdown("### Raster info")
-st.sidebar.write(f"**Original CRS:** {da.rio.crs}")
+st.sidebar.write(f"**Original CRS:** {info['crs']}")
 st.sidebar.write("**Display CRS:** EPSG:4326")
 st.sidebar.write(f"**Bounds (lon/lat):** [{minx:.3f}, {miny:.3f}, {maxx:.3f}, {maxy:.3f}]")
-st.sidebar.write(f"**Min intensity (after mask):** {valid.min():.3f}")
-st.sidebar.write(f"**Max intensity (after mask):** {valid.max():.3f}")
-st.sidebar.write(f"**Mean intensity:** {valid.mean():.3f}")
+st.sidebar.write(f"**Min intensity (after mask):** {info['depth_min']:.3f}")
+st.sidebar.write(f"**Max intensity (after mask):** {info['depth_max']:.3f}")
+st.sidebar.write(f"**Mean intensity:** {info['depth_mean']:.3f}")
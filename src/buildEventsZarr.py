@@ -0,0 +1,91 @@
+"""
+Pre-render every flood event for the dashboard into ONE Zarr store.
+
+For each per-event GeoTIFF this script:
+- Colour-maps it for display with eventRgba.event_to_rgba (the same
+  pipeline the dashboard runs on request)
+- Writes the uint8 RGBA array to data/events.zarr under the event key,
+  chunked and Blosc/zstd-compressed, with bounds + stats as attrs
+- Records the source file's mtime, so re-runs only re-render changed
+  rasters and the dashboard can tell when an entry is out of date
+
+The dashboard (src/app.py) then only does a key lookup in the store.
+Events that are missing from the store (new, changed, or without flood
+pixels) are still colour-mapped from their GeoTIFF on request.
+
+Run:
+    python src/buildEventsZarr.py
+"""
+
+from pathlib import Path
+
+import zarr
+from zarr.codecs import BloscCodec
+
+from eventRgba import event_to_rgba
+
+# ---------------------- CONFIG ---------------------------------
+
+# Folder with one GeoTIFF per event (same folder the dashboard lists)
+EVENTS_DIR = Path("data/one")
+
+# Output Zarr store: one array per event key (uint8 RGBA)
+ZARR_PATH = Path("data/events.zarr")
+
+# Zarr chunking and compression of the stored RGBA arrays
+ZARR_CHUNKS = (512, 512, 4)
+ZARR_COMPRESSOR = BloscCodec(cname="zstd", clevel=3)
+
+# ---------------------------------------------------------------
+
+
+def find_all_tifs(root: Path):
+    """Return sorted list of all .tif files under root."""
+    return sorted(root.glob("*.tif"))
+
+
+def build_store():
+    """Write one RGBA array per event into ZARR_PATH, skipping up-to-date keys."""
+    tif_files = find_all_tifs(EVENTS_DIR)
+    if not tif_files:
+        print(f"No .tif files found in {EVENTS_DIR}.")
+        return
+
+    print(f"Found {len(tif_files)} event rasters in {EVENTS_DIR}.")
+    root = zarr.open_group(str(ZARR_PATH), mode="a")
+
+    for f in tif_files:
+        key = f.stem
+        mtime_ns = f.stat().st_mtime_ns
+        if key in root and root[key].attrs.get("source_mtime_ns", -1) >= mtime_ns:
+            print(f"  Skipping {key} (up to date in store)")
+            continue
+
+        print(f"  Rendering {key} ...")
+        try:
+            rgba, bounds, info = event_to_rgba(f)
+        except Exception as e:
+            print(f"  ERROR on {key}: {e}")
+            continue
+
+        if rgba is None:
+            # Left to the dashboard, which warns about it on request
+            print(f"  {key}: no valid flood pixels, not stored.")
+            if key in root:
+                del root[key]
+            continue
+
+        z = root.create_array(
+            key,
+            data=rgba,
+            chunks=ZARR_CHUNKS,
+            compressors=ZARR_COMPRESSOR,
+            overwrite=True,
+        )
+        z.attrs.update(bounds=list(bounds), info=info, source_mtime_ns=mtime_ns)
+
+    print(f"Done. Store: {ZARR_PATH}")
+
+
+if __name__ == "__main__":
+    build_store()
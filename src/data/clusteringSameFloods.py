@@ -10,13 +10,24 @@ Run:
     python preprocess_events.py
 """
 
+import multiprocessing as mp
+import os
 import re
+import threading
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
 from pathlib import Path
 
+import dask
 import numpy as np
 import xarray as xr
 import rioxarray
+from numba import njit
+from rioxarray.merge import merge_arrays
+
+# Shared with src/eventRgba.py (dashboard RGBA stretch)
+from rasterStats import fast_pct
 
 
 # ---------------------- CONFIG ---------------------------------
@@ -38,6 +49,30 @@ DEFAULT_CRS = "EPSG:27704"
 # Reproject final output to this CRS (for web maps / folium).
 OUT_CRS = "EPSG:4326"
 
+# Number of events processed in parallel (one process per event)
+MAX_WORKERS = os.cpu_count()
+
+# GDAL warp working memory in MB. The GDAL / Dask threads per worker
+# are derived from the actual pool size (see _threads_per_worker).
+WARP_MEM_LIMIT = 512
+
+# Dask chunk size used when opening rasters (read lazily, tile by tile)
+CHUNKS = {"x": 2048, "y": 2048}
+
+# GeoTIFF creation options: 512x512 tiles, LZW + horizontal predictor
+GTIFF_OPTIONS = dict(
+    tiled=True,
+    blockxsize=512,
+    blockysize=512,
+    compress="LZW",
+    predictor=2,
+    BIGTIFF="IF_SAFER",
+)
+
+# Outputs are stored as uint8 codes (0 = no flood) stretched between
+# these depth percentiles; the physical range goes in the VMIN/VMAX tags.
+QUANT_PCT = (2, 98)
+
 # ---------------------------------------------------------------
 
 # Filenames follow:
@@ -65,6 +100,40 @@ def event_key(path: Path) -> str:
     return f"{start}__{end}"
 
 
+def quantize_uint8(arr, plo=QUANT_PCT[0], phi=QUANT_PCT[1]):
+    """
+    Quantize flood depth to uint8 codes 1..255 (0 = no flood / nodata).
+
+    Depths are stretched linearly between the (plo, phi) percentiles and
+    clipped. Returns (codes, vmin, vmax), with
+    depth ≈ vmin + (code - 1) * (vmax - vmin) / 254.
+    """
+    flooded = arr > 0  # NaN compares False
+    q = np.zeros(arr.shape, dtype=np.uint8)
+    if not flooded.any():
+        return q, 0.0, 0.0
+
+    vmin, vmax = fast_pct(arr[flooded], plo, phi)
+    scale = 254 / (vmax - vmin) if vmax > vmin else 0.0
+    q[flooded] = 1 + np.rint(
+        np.clip((arr[flooded] - vmin) * scale, 0, 254)
+    ).astype(np.uint8)
+    return q, vmin, vmax
+
+
+def quant_tags(arr, vmin, vmax):
+    """
+    GeoTIFF tags for a quantized raster: the stretch range (VMIN/VMAX)
+    plus the true depth range (DEPTH_MIN/DEPTH_MAX), which the codes
+    lose to percentile clipping.
+    """
+    tags = {"VMIN": vmin, "VMAX": vmax}
+    flooded = arr[arr > 0]  # NaN compares False
+    if flooded.size:
+        tags.update(DEPTH_MIN=float(flooded.min()), DEPTH_MAX=float(flooded.max()))
+    return tags
+
+
 def group_files_by_event(tif_files):
     """Return dict: event_key -> [Path, Path, ...]."""
     events = defaultdict(list)
@@ -74,17 +143,48 @@ def group_files_by_event(tif_files):
     return events
 
 
+@njit(cache=True)
+def _clean_np(a, nodata):
+    """
+    Set nodata and non-positive ("no flood") pixels to NaN, as float32.
+
+    Runs once per Dask chunk; Dask already spreads chunks over threads,
+    so the loop itself is serial.
+    """
+    flat = a.ravel()
+    out = np.empty(flat.size, dtype=np.float32)
+    for i in range(flat.size):
+        v = flat[i]
+        out[i] = np.nan if (v == nodata or v <= 0) else v
+    return out.reshape(a.shape)
+
+
+def clean_nodata(da):
+    """Lazily apply `_clean_np` chunk by chunk; result has NaN as nodata."""
+    nodata = da.rio.nodata
+    nodata = np.nan if nodata is None else float(nodata)
+    cleaned = xr.apply_ufunc(
+        _clean_np,
+        da,
+        nodata,
+        dask="parallelized",
+        output_dtypes=[np.float32],
+        keep_attrs=True,
+    )
+    return cleaned.rio.write_nodata(np.nan)
+
+
 def load_and_mosaic(files, max_size=MAX_SIZE):
     """
     Open all GeoTIFFs in `files` safely:
     - EARLY downsampling before any large memory operations
-    - force float32 to reduce RAM usage
-    - reproject to common grid
-    - merge using max intensity
+    - clean nodata / non-positive values to NaN (float32, chunk by chunk)
+    - merge onto the first raster's grid using max intensity
     """
-    # 1) Open rasters
+    # 1) Open rasters (lazy, Dask-backed)
     das = [
-        rioxarray.open_rasterio(str(f)).squeeze("band", drop=True)
+        rioxarray.open_rasterio(str(f), chunks=CHUNKS, lock=False)
+        .squeeze("band", drop=True)
         for f in files
     ]
 
@@ -106,39 +206,90 @@ def load_and_mosaic(files, max_size=MAX_SIZE):
             da.coarsen(y=factor, x=factor, boundary="trim").mean()
             for da in das
         ]
+        # coarsen() keeps the original GeoTransform; rebuild it from the
+        # new coords so resolution()/bounds() below see the coarse grid
+        das = [da.rio.write_transform(da.rio.transform(recalc=True)) for da in das]
 
-    # After downsampling, choose base for reprojection
+    # After downsampling, choose base grid (extent + resolution)
     base = das[0]
+    res_x, res_y = (abs(r) for r in base.rio.resolution())
+
+    # 4) Clean nodata and non-positive values (lazy, float32)
+    das = [clean_nodata(da) for da in das]  # 🔥 avoid float64
+
+    # 5) Merge using max across clusters, warping onto the base grid
+    #    window by window (no stack of N full-size copies)
+    da_merged = merge_arrays(
+        das,
+        bounds=base.rio.bounds(),
+        res=(res_x, res_y),
+        nodata=np.nan,
+        method="max",
+    )
+
+    # 6) Carry CRS
+    da_merged = da_merged.rio.write_crs(base.rio.crs)
 
-    # 4) Reproject all rasters to match base
-    das_match = [da.rio.reproject_match(base) for da in das]
-
-    # 5) Clean nodata and ensure float32
-    cleaned = []
-    for da in das_match:
-        arr = da.values.astype("float32")  # 🔥 avoid float64
-        nodata = da.rio.nodata
-        if nodata is not None:
-            arr[arr == nodata] = np.nan
-        arr[arr <= 0] = np.nan
-
-        da_clean = xr.DataArray(
-            arr,
-            coords=da.coords,
-            dims=da.dims,
-            attrs=da.attrs,
-        )
-        cleaned.append(da_clean)
+    return da_merged
 
-    # 6) Merge using max across clusters
-    stack = xr.concat(cleaned, dim="cluster")
-    da_merged = stack.max(dim="cluster", skipna=True)
 
-    # 7) Carry CRS
-    da_merged = da_merged.rio.write_crs(base.rio.crs)
 
-    return da_merged
+def _threads_per_worker(n_workers):
+    """Split the CPUs across the pool so workers x threads <= cpu_count."""
+    return max(1, (os.cpu_count() or 1) // n_workers)
+
+
+# Set in each worker by _init_worker: queue the parent reads to know
+# which events actually started when the pool breaks
+_started = None
+
 
+def _init_worker(started):
+    global _started
+    _started = started
+
+
+def _process_event(args):
+    """
+    Merge, reproject and save one event. Runs in a worker process.
+
+    `args` is a (key, files, num_threads) tuple; returns a log message.
+    """
+    key, files, num_threads = args
+    if _started is not None:
+        _started.put(key)
+    start_end = key  # e.g. "2024-12-16__2024-12-23"
+    out_path = OUT_DIR / f"flood_{start_end}.tif"
+
+    try:
+        # Merge clusters (Dask limited to this worker's share of threads)
+        with dask.config.set(scheduler="threads", num_workers=num_threads):
+            da_merged = load_and_mosaic(files, max_size=MAX_SIZE)
+
+        # Reproject to OUT_CRS (e.g. EPSG:4326)
+        da_out = da_merged.rio.reproject(
+            OUT_CRS,
+            num_threads=num_threads,
+            warp_mem_limit=WARP_MEM_LIMIT,
+        )
+
+        # Quantize depth to uint8 codes, keep physical range in tags
+        q, vmin, vmax = quantize_uint8(da_out.values)
+        da_q = da_out.copy(data=q).rio.write_nodata(0)
+
+        # Save as GeoTIFF (compressed)
+        da_q.rio.to_raster(
+            out_path,
+            driver="GTiff",
+            dtype="uint8",
+            tags=quant_tags(da_out.values, vmin, vmax),
+            windowed=True,
+            lock=threading.Lock(),
+            **GTIFF_OPTIONS,
+        )
+        return f"{start_end} ({len(files)} file(s)) → saved: {out_path}"
+    except Exception as e:
+        return f"ERROR processing event {start_end}: {e}"
 
 
 def preprocess_all():
@@ -154,34 +305,72 @@ def preprocess_all():
     events = group_files_by_event(tif_files)
     print(f"Detected {len(events)} unique events.\n")
 
-    for i, (key, files) in enumerate(events.items(), start=1):
-        start_end = key  # e.g. "2024-12-16__2024-12-23"
-        out_name = f"flood_{start_end}.tif"
-        out_path = OUT_DIR / out_name
-
+    todo = []
+    for key, files in events.items():
+        out_path = OUT_DIR / f"flood_{key}.tif"
         if out_path.exists():
-            print(f"[{i}/{len(events)}] {start_end} → already processed, skip.")
+            print(f"{key} → already processed, skip.")
             continue
+        todo.append((key, files))
+
+    print(f"Processing {len(todo)} event(s) ...")
+
+    # Events are independent (own files, own output): one process each.
+    # If a worker dies (e.g. OOM) the pool breaks and every pending event
+    # fails with it; only the events that had started are suspects, the
+    # rest go to a fresh full-size pool.
+    total, done = len(todo), 0
+    suspects = []
+    while todo:
+        n_workers = min(MAX_WORKERS, len(todo))
+        num_threads = _threads_per_worker(n_workers)
+        started = mp.SimpleQueue()
+        broken = []
+        with ProcessPoolExecutor(
+            max_workers=n_workers, initializer=_init_worker, initargs=(started,)
+        ) as ex:
+            futures = {
+                ex.submit(_process_event, (key, files, num_threads)): (key, files)
+                for key, files in todo
+            }
+            for fut in as_completed(futures):
+                key = futures[fut][0]
+                try:
+                    res = fut.result()
+                except BrokenProcessPool:
+                    broken.append(futures[fut])
+                    continue
+                except Exception as e:
+                    res = f"ERROR processing event {key}: {e}"
+                done += 1
+                print(f"[{done}/{total}] {res}")
+
+        ran = set()
+        while not started.empty():
+            ran.add(started.get())
+        crashed = [item for item in broken if item[0] in ran]
+        todo = [item for item in broken if item[0] not in ran]
+        if broken and not crashed:
+            # Died before any event started: isolate them all, no loop
+            crashed, todo = broken, []
+        if broken:
+            print(
+                f"Worker pool crashed: {len(crashed)} event(s) will retry on "
+                f"their own, {len(todo)} resubmitted."
+            )
+        suspects += crashed
 
-        print(f"[{i}/{len(events)}] Processing event {start_end} "
-              f"({len(files)} file(s)) ...")
-
+    # Retry crashed events one by one, each in its own process, so a
+    # single bad event cannot take the others down with it
+    for key, files in suspects:
         try:
-            # Merge clusters
-            da_merged = load_and_mosaic(files, max_size=MAX_SIZE)
-
-            # Reproject to OUT_CRS (e.g. EPSG:4326)
-            da_out = da_merged.rio.reproject(OUT_CRS)
-
-            # Save as GeoTIFF (compressed)
-            da_out.rio.to_raster(
-                out_path,
-                compress="LZW",
-                dtype="float32",
-            )
-            print(f"    Saved: {out_path}")
+            with ProcessPoolExecutor(max_workers=1) as ex:
+                res = ex.submit(
+                    _process_event, (key, files, _threads_per_worker(1))
+                ).result()
         except Exception as e:
-            print(f"    ERROR processing event {start_end}: {e}")
+            res = f"ERROR processing event {key}: {e!r}"
+        print(f"[retry] {res}")
 
     print("\nDone. All merged events written to:", OUT_DIR)
 
@@ -49,23 +49,30 @@ def main():
     if countries.empty:
         raise ValueError("No matching target countries found in shapefile.")
 
-    # Union of all selected countries
-    target_geom = countries.geometry.unary_union
-
-    # 2) Iterate event rasters
+    # 2) Collect event raster bounding boxes
     tifs = sorted(IN_DIR.glob("*.tif"))
     if not tifs:
         print(f"No .tif files found in {IN_DIR}")
         return
 
-    kept, skipped = 0, 0
-
+    geoms = []
     for tif in tifs:
         with rasterio.open(tif) as src:
             b = src.bounds  # should already be in EPSG:4326
-            event_poly = box(b.left, b.bottom, b.right, b.top)
+        geoms.append(box(b.left, b.bottom, b.right, b.top))
+
+    rast_gdf = gpd.GeoDataFrame({"path": tifs}, geometry=geoms, crs="EPSG:4326")
+
+    # 3) One spatial join against the selected countries (STRtree index)
+    hits = gpd.sjoin(
+        rast_gdf, countries[["geometry"]], predicate="intersects", how="inner"
+    )
+    keep = rast_gdf.index.isin(hits.index)
+
+    kept, skipped = 0, 0
 
-        if event_poly.intersects(target_geom):
+    for tif, is_hit in zip(tifs, keep):
+        if is_hit:
             shutil.copy2(tif, OUT_DIR / tif.name)
             kept += 1
             print(f"KEEP   {tif.name}")
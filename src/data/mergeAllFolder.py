@@ -18,6 +18,8 @@ Run:
     python src/data/mergeAllFolder.py
 """
 
+import os
+import threading
 from pathlib import Path
 
 import numpy as np
@@ -26,6 +28,9 @@ import rioxarray
 import rasterio
 from rasterio.transform import from_bounds
 
+# Same uint8 quantization as the per-event rasters
+from clusteringSameFloods import quant_tags, quantize_uint8
+
 # ---------------------- CONFIG ---------------------------------
 
 # Folder where your per-event rasters are stored
@@ -40,6 +45,23 @@ TARGET_CRS = "EPSG:4326"
 # Limit size of global raster for memory (max width/height in pixels)
 MAX_SIZE_GLOBAL = 2000  # tweak if needed (bigger = more detail & RAM)
 
+# GDAL warp settings for reprojection (threads, working memory in MB)
+NUM_THREADS = os.cpu_count()
+WARP_MEM_LIMIT = 512
+
+# Dask chunk size used when opening rasters (read lazily, tile by tile)
+CHUNKS = {"x": 2048, "y": 2048}
+
+# GeoTIFF creation options: 512x512 tiles, LZW + horizontal predictor
+GTIFF_OPTIONS = dict(
+    tiled=True,
+    blockxsize=512,
+    blockysize=512,
+    compress="LZW",
+    predictor=2,
+    BIGTIFF="IF_SAFER",
+)
+
 # ---------------------------------------------------------------
 
 
@@ -48,52 +70,66 @@ def find_all_tifs(root: Path):
     return sorted(root.glob("*.tif"))
 
 
+def dequantize(arr, vmin, vmax):
+    """Map uint8 codes 1..255 back to depth; code 0 (no flood) becomes NaN."""
+    depth = vmin + (arr.astype("float32") - 1) * ((vmax - vmin) / 254)
+    return np.where(arr > 0, depth, np.nan).astype("float32")
+
+
 def scan_global_extent(files):
     """
     Compute the union of bounds (in TARGET_CRS) and a representative resolution.
 
+    Also returns `metas = [(path, bounds, transform, crs)]`, one per file, so
+    the merge loop can reuse this metadata instead of re-parsing it.
+
     We assume all rasters are already in TARGET_CRS (from your preprocess script).
     If not, you can reproject here, but that would be weird given your pipeline.
     """
-    global_minx = np.inf
-    global_miny = np.inf
-    global_maxx = -np.inf
-    global_maxy = -np.inf
+    all_bounds = []
+    metas = []
     res_x = None
     res_y = None
 
     for i, f in enumerate(files):
-        da = rioxarray.open_rasterio(str(f)).squeeze("band", drop=True)
+        # Metadata only: no pixel data or xarray wrapper needed here
+        with rasterio.open(f) as ds:
+            crs = ds.crs
+            bounds = ds.bounds
+            transform = ds.transform
 
-        if da.rio.crs is None:
+        if crs is None:
             raise ValueError(f"Raster {f} has no CRS; please fix preprocessing.")
 
-        crs_str = da.rio.crs.to_string()
+        crs_str = crs.to_string()
         if crs_str != TARGET_CRS:
             raise ValueError(
                 f"Raster {f} has CRS {crs_str}, not {TARGET_CRS}. "
                 "All per-event rasters should have the same CRS."
             )
 
-        minx, miny, maxx, maxy = da.rio.bounds()
-
-        global_minx = min(global_minx, minx)
-        global_miny = min(global_miny, miny)
-        global_maxx = max(global_maxx, maxx)
-        global_maxy = max(global_maxy, maxy)
+        all_bounds.append([bounds.left, bounds.bottom, bounds.right, bounds.top])
+        metas.append((f, bounds, transform, crs))
 
         if i == 0:
             # Derive pixel size from first file
-            transform = da.rio.transform()
             # transform.a = pixel width (positive)
             # transform.e = pixel height (negative)
             res_x = transform.a
             res_y = -transform.e  # store as positive
 
+    if not all_bounds:
+        raise ValueError("Failed to compute valid global extent.")
+
+    # Union of extents in one reduction: columns are (minx, miny, maxx, maxy)
+    arr = np.array(all_bounds, dtype=np.float64)
+    global_minx, global_miny = arr[:, :2].min(axis=0).tolist()
+    global_maxx, global_maxy = arr[:, 2:].max(axis=0).tolist()
+
     if not np.isfinite(global_minx):
         raise ValueError("Failed to compute valid global extent.")
 
-    return global_minx, global_miny, global_maxx, global_maxy, res_x, res_y
+    return global_minx, global_miny, global_maxx, global_maxy, res_x, res_y, metas
 
 
 def build_global_grid(minx, miny, maxx, maxy, res_x, res_y, max_size=MAX_SIZE_GLOBAL):
@@ -128,7 +164,7 @@ def merge_event_rasters_union(files):
     Merge many per-event rasters on a global grid that covers the union of extents.
     """
     print("Computing global extent and resolution from all files...")
-    minx, miny, maxx, maxy, res_x, res_y = scan_global_extent(files)
+    minx, miny, maxx, maxy, res_x, res_y, metas = scan_global_extent(files)
     print(f"  Global bounds: [{minx:.4f}, {miny:.4f}, {maxx:.4f}, {maxy:.4f}]")
     print(f"  Base resolution: dx={res_x}, dy={res_y}")
 
@@ -141,17 +177,16 @@ def merge_event_rasters_union(files):
     # Prepare an empty composite array (float32, filled with NaN)
     comp_arr = np.full((height, width), np.nan, dtype="float32")
 
-    # For each raster: reproject to this global grid, then update comp_arr = max
-    for f in files:
-        print(f"  Merging {f.name} ...")
-        da = rioxarray.open_rasterio(str(f)).squeeze("band", drop=True)
+    # True depth range over all events (quantized inputs clip to VMIN/VMAX)
+    depth_min, depth_max = np.inf, -np.inf
 
-        if da.rio.crs is None:
-            raise ValueError(f"Raster {f} has no CRS; please fix preprocessing.")
-        if da.rio.crs.to_string() != TARGET_CRS:
-            raise ValueError(
-                f"Raster {f} has CRS {da.rio.crs.to_string()}, not {TARGET_CRS}."
-            )
+    # For each raster: reproject to this global grid, then update comp_arr = max.
+    # CRS was already validated by the scan, so files are only opened for data.
+    for f, _bounds, _transform, _crs in metas:
+        print(f"  Merging {f.name} ...")
+        da = rioxarray.open_rasterio(
+            str(f), chunks=CHUNKS, lock=False, cache=False
+        ).squeeze("band", drop=True)
 
         # Reproject directly onto the global grid
         da_warped = da.rio.reproject(
@@ -159,6 +194,8 @@ def merge_event_rasters_union(files):
             transform=transform,
             shape=(height, width),
             resampling=rasterio.enums.Resampling.nearest,
+            num_threads=NUM_THREADS,
+            warp_mem_limit=WARP_MEM_LIMIT,
         )
 
         arr = da_warped.values.astype("float32")
@@ -167,29 +204,30 @@ def merge_event_rasters_union(files):
             arr[arr == nodata] = np.nan
         arr[arr <= 0] = np.nan  # treat non-positive as no flood
 
-        mask_new = ~np.isnan(arr)
-        mask_old = ~np.isnan(comp_arr)
+        # Quantized event rasters: convert codes back to depth before max
+        if "VMIN" in da_warped.attrs:
+            arr = dequantize(
+                arr, float(da_warped.attrs["VMIN"]), float(da_warped.attrs["VMAX"])
+            )
 
-        # Where only new has data
-        comp_arr[mask_new & ~mask_old] = arr[mask_new & ~mask_old]
+        if "DEPTH_MAX" in da_warped.attrs:
+            lo = float(da_warped.attrs["DEPTH_MIN"])
+            hi = float(da_warped.attrs["DEPTH_MAX"])
+        elif not np.isnan(arr).all():
+            lo, hi = float(np.nanmin(arr)), float(np.nanmax(arr))
+        else:
+            lo, hi = np.inf, -np.inf
+        depth_min, depth_max = min(depth_min, lo), max(depth_max, hi)
 
-        # Where both have data → max
-        both = mask_new & mask_old
-        comp_arr[both] = np.maximum(comp_arr[both], arr[both])
+        # NaN-aware max in place: where only one side has data it wins
+        np.fmax(comp_arr, arr, out=comp_arr)
 
     # Build xarray DataArray with correct coordinates & transform
     # y: from top (north) downward
     # x: from west to east
-    ys = np.linspace(
-        transform.f + transform.e / 2,
-        transform.f + transform.e / 2 + (height - 1) * transform.e,
-        height,
-    )
-    xs = np.linspace(
-        transform.c + transform.a / 2,
-        transform.c + transform.a / 2 + (width - 1) * transform.a,
-        width,
-    )
+    # Pixel centres straight from the affine: origin + (index + 0.5) * size
+    ys = transform.f + (np.arange(height, dtype=np.float64) + 0.5) * transform.e
+    xs = transform.c + (np.arange(width, dtype=np.float64) + 0.5) * transform.a
 
     composite = xr.DataArray(
         comp_arr,
@@ -198,6 +236,8 @@ def merge_event_rasters_union(files):
     )
     composite = composite.rio.write_crs(TARGET_CRS)
     composite = composite.rio.write_transform(transform)
+    if depth_max >= depth_min:
+        composite.attrs.update(DEPTH_MIN=depth_min, DEPTH_MAX=depth_max)
 
     return composite
 
@@ -223,11 +263,25 @@ def main():
     try:
         da_merged = merge_event_rasters_union(tif_files)
 
+        # Quantize depth to uint8 codes, keep physical range in tags
+        q, vmin, vmax = quantize_uint8(da_merged.values)
+        da_q = da_merged.copy(data=q).rio.write_nodata(0)
+        tags = quant_tags(da_merged.values, vmin, vmax)
+        if "DEPTH_MAX" in da_merged.attrs:
+            tags.update(
+                DEPTH_MIN=da_merged.attrs["DEPTH_MIN"],
+                DEPTH_MAX=da_merged.attrs["DEPTH_MAX"],
+            )
+
         print(f"Saving global merged raster to: {OUT_PATH}")
-        da_merged.rio.to_raster(
+        da_q.rio.to_raster(
             OUT_PATH,
-            compress="LZW",
-            dtype="float32",
+            driver="GTiff",
+            dtype="uint8",
+            tags=tags,
+            windowed=True,
+            lock=threading.Lock(),
+            **GTIFF_OPTIONS,
         )
         print("Done.")
     except Exception as e:
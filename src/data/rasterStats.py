@@ -0,0 +1,26 @@
+"""
+Small numpy-only raster statistics shared by the pipeline scripts.
+
+Kept free of numba / GDAL so it can be imported from both script roots:
+    from rasterStats import fast_pct        (scripts in src/data/)
+    from data.rasterStats import fast_pct   (scripts in src/)
+"""
+
+import numpy as np
+
+
+def fast_pct(arr, plo=2, phi=98, n=200_000):
+    """
+    Approximate (plo, phi) percentiles of the non-NaN values in `arr`.
+
+    Uses a fixed-seed random subsample of at most `n` pixels and
+    np.partition instead of sorting the whole array.
+    """
+    v = arr.ravel()
+    v = v[~np.isnan(v)]
+    if v.size > n:
+        v = v[np.random.default_rng(0).integers(0, v.size, n)]
+    lo = min(int(v.size * plo / 100), v.size - 1)
+    hi = min(int(v.size * phi / 100), v.size - 1)
+    part = np.partition(v, [lo, hi])
+    return float(part[lo]), float(part[hi])
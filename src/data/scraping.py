@@ -1,47 +1,67 @@
 import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
 import requests
-from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
 from urllib.parse import urljoin
 
 BASE_URL = "https://jeodpp.jrc.ec.europa.eu/ftp/jrc-opendata/CEMS-EFAS/European_Satellite-Derived_Flood_Depth_Maps/maps/"
 YEARS = list(range(2015, 2025))
 OUTPUT_DIR = "JRC_flood_depth_maps"
+MAX_WORKERS = 16  # concurrent page fetches / downloads
+# (connect, read) timeout in seconds for file downloads; the read timeout
+# is the longest stall allowed between two chunks, not the whole transfer
+DOWNLOAD_TIMEOUT = (10, 60)
 
 os.makedirs(OUTPUT_DIR, exist_ok=True)
 
-def get_links(url):
-    response = requests.get(url)
-    soup = BeautifulSoup(response.content, "html.parser")
-    links = []
-    for link in soup.find_all("a"):
-        href = link.get("href")
-        if href and href.endswith(".tif"):
-            links.append(urljoin(url, href))
-    return links
+# One shared session: connection pooling + keep-alive across all requests
+session = requests.Session()
+session.mount(
+    "https://",
+    HTTPAdapter(pool_connections=32, pool_maxsize=32, max_retries=3),
+)
+
+# Directory listings only contain plain <a href="...tif"> entries
+TIF_HREF = re.compile(rb'href="([^"]+\.tif)"')
+
+def get_links(url, session):
+    response = session.get(url, timeout=30)
+    response.raise_for_status()
+    return [urljoin(url, href.decode()) for href in TIF_HREF.findall(response.content)]
 
-print(get_links(BASE_URL))
+print(get_links(BASE_URL, session))
 
 
-def download_file(url, dest_folder):
+def download_file(url, dest_folder, session):
     local_filename = os.path.join(dest_folder, os.path.basename(url))
     if os.path.exists(local_filename):
         print(f"Already downloaded: {local_filename}")
         return
-    with requests.get(url, stream=True) as r:
+    with session.get(url, stream=True, timeout=DOWNLOAD_TIMEOUT) as r:
         r.raise_for_status()
-        with open(local_filename, 'wb') as f:
+        # Write to a .part file first: a timed-out transfer must not be
+        # mistaken for a finished download on the next run
+        part_filename = local_filename + ".part"
+        with open(part_filename, 'wb') as f:
             for chunk in r.iter_content(chunk_size=8192):
                 f.write(chunk)
+        os.replace(part_filename, local_filename)
     print(f"Downloaded: {local_filename}")
 
 
     # Main loop
-for year in YEARS:
-    year_url = f"{BASE_URL}{year}/"
-    print(f"Scanning {year_url}")
-    links = get_links(year_url)
-    year_folder = os.path.join(OUTPUT_DIR, str(year))
-    os.makedirs(year_folder, exist_ok=True)
-    for link in links:
-        download_file(link, year_folder)
+year_urls = [f"{BASE_URL}{year}/" for year in YEARS]
+with ThreadPoolExecutor(max_workers=MAX_WORKERS) as ex:
+    # Fetch all year listings concurrently
+    print(f"Scanning {len(year_urls)} year folders under {BASE_URL}")
+    year_links = list(ex.map(partial(get_links, session=session), year_urls))
 
+    for year, links in zip(YEARS, year_links):
+        year_folder = os.path.join(OUTPUT_DIR, str(year))
+        os.makedirs(year_folder, exist_ok=True)
+        print(f"{year}: {len(links)} file(s)")
+        download = partial(download_file, dest_folder=year_folder, session=session)
+        list(ex.map(download, links))
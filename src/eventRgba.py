@@ -0,0 +1,182 @@
+"""
+Event raster → display RGBA, shared by the dashboard and the Zarr builder.
+
+- Downsamples an event GeoTIFF for display and reprojects it to EPSG:4326
+- Applies the percentile stretch + turbo colormap (uint8 RGBA, alpha 0
+  where there is no flood)
+- Computes the sidebar stats (min / max / mean depth)
+
+Used by:
+    src/app.py                    (on request, for events not in the store)
+    src/appOlder.py               (on every rerun)
+    src/buildEventsZarr.py        (offline, to fill data/events.zarr)
+"""
+
+import os
+
+import numpy as np
+import rioxarray
+import matplotlib
+from numba import njit
+
+# Same percentile estimate as the preprocessing scripts
+from data.rasterStats import fast_pct
+
+# ---------------------- CONFIG ---------------------------------
+
+# Maximum pixels in width/height before light downsampling for display
+MAX_SIZE = 3000
+
+# Percentiles used for the intensity contrast stretch
+VMIN_PCT = 2
+VMAX_PCT = 98
+
+# CRS assumed for rasters without one (your EFAS files are in EPSG:27704)
+DEFAULT_CRS = "EPSG:27704"
+
+# GDAL warp settings for reprojection (threads, working memory in MB)
+NUM_THREADS = os.cpu_count()
+WARP_MEM_LIMIT = 512
+
+# Dask chunk size used when opening rasters (read lazily, tile by tile)
+CHUNKS = {"x": 2048, "y": 2048}
+
+# ---------------------------------------------------------------
+
+
+# 256-entry uint8 RGBA lookup table for the intensity colormap
+# (try 'jet', 'plasma', 'viridis' if you prefer)
+TURBO_LUT = (
+    matplotlib.colormaps["turbo"](np.linspace(0, 1, 256)) * 255
+).astype(np.uint8)
+
+
+# Serial: Streamlit runs scripts on per-session threads, where Numba's
+# parallel threading layers are unsafe. No fastmath: it would let LLVM
+# assume away the NaN checks.
+@njit(cache=True)
+def stretch_colorize(arr, vmin, vmax, nodata, lut, out):
+    """
+    Fused nodata mask + percentile stretch + colormap lookup.
+
+    Writes uint8 RGBA into `out` in a single pass over `arr`. Pixels equal
+    to `nodata`, non-positive or NaN become fully transparent.
+    """
+    scale = 1.0 / (vmax - vmin) if vmax > vmin else 0.0
+    for i in range(arr.shape[0]):
+        for j in range(arr.shape[1]):
+            v = arr[i, j]
+            if v == nodata or v <= 0 or np.isnan(v):
+                out[i, j, 0] = 0
+                out[i, j, 1] = 0
+                out[i, j, 2] = 0
+                out[i, j, 3] = 0
+                continue
+            t = (v - vmin) * scale
+            if t <= 0:
+                idx = 0
+            elif t >= 1:
+                idx = 255
+            else:
+                idx = int(t * 256)  # same binning as Colormap.__call__
+            out[i, j, 0] = lut[idx, 0]
+            out[i, j, 1] = lut[idx, 1]
+            out[i, j, 2] = lut[idx, 2]
+            out[i, j, 3] = 255
+
+
+def code_lut(vmin, vmax, nodata):
+    """
+    256-entry RGBA table mapping uint8 codes straight to colours.
+
+    Built with `stretch_colorize` itself, so `code_lut(...)[codes]` gives
+    exactly the same pixels as running the kernel over `codes`.
+    """
+    codes = np.arange(256, dtype=np.float64).reshape(256, 1)
+    lut = np.empty((256, 1, 4), dtype=np.uint8)
+    stretch_colorize(codes, vmin, vmax, nodata, TURBO_LUT, lut)
+    return lut[:, 0]
+
+
+def event_to_rgba(path, max_size=MAX_SIZE, vmin_pct=VMIN_PCT, vmax_pct=VMAX_PCT):
+    """
+    Read, downsample, reproject and colour-map one event raster.
+
+    Returns (rgba_uint8, (miny, minx, maxy, maxx), info). `info` holds
+    "crs" and the data stats "depth_min" / "depth_max" / "depth_mean"
+    (the stretch percentiles are not stored). `rgba_uint8` is None when
+    the raster has no valid flood pixels.
+    """
+    # Open raster (assumed single band)
+    da = rioxarray.open_rasterio(str(path), chunks=CHUNKS, lock=False)
+    da = da.squeeze("band", drop=True)  # remove band dimension
+
+    if da.rio.crs is None:
+        da = da.rio.write_crs(DEFAULT_CRS)
+
+    # Quantized rasters (uint8 codes 1..255, 0 = no flood) carry their
+    # physical depth range in the VMIN/VMAX tags
+    depth_range = None
+    if "VMIN" in da.attrs:
+        depth_range = (float(da.attrs["VMIN"]), float(da.attrs["VMAX"]))
+
+    # The codes clip at the stretch percentiles; the true min/max are tagged
+    true_range = None
+    if "DEPTH_MAX" in da.attrs:
+        true_range = (float(da.attrs["DEPTH_MIN"]), float(da.attrs["DEPTH_MAX"]))
+
+    # Optional: light downsampling for faster display if very large
+    ny, nx = da.sizes["y"], da.sizes["x"]
+    scale = max(ny, nx) / max_size
+    if scale > 1:
+        factor = int(np.ceil(scale))
+        if da.rio.nodata is not None:
+            da = da.where(da != da.rio.nodata)  # keep nodata out of the mean
+        da = da.coarsen(y=factor, x=factor, boundary="trim").mean()
+
+    # Reproject to WGS84 (lat/lon)
+    da_ll = da.rio.reproject(
+        "EPSG:4326",
+        num_threads=NUM_THREADS,
+        warp_mem_limit=WARP_MEM_LIMIT,
+    )
+
+    # Nodata and non-positive ("no flood") pixels are masked by the kernel
+    nodata = da_ll.rio.nodata
+    nodata = np.nan if nodata is None else float(nodata)
+    arr = da_ll.values
+
+    minx, miny, maxx, maxy = da_ll.rio.bounds()
+    bounds = (float(miny), float(minx), float(maxy), float(maxx))
+    info = {"crs": str(da.rio.crs)}
+
+    valid = arr[(arr > 0) & (arr != nodata)]
+    if valid.size == 0:
+        return None, bounds, info
+
+    # Stats in physical units; the colour stretch works on codes directly
+    depth = valid
+    if depth_range is not None:
+        lo, hi = depth_range
+        depth = lo + (valid.astype("float32") - 1) * ((hi - lo) / 254)
+
+    depth_min, depth_max = true_range or (depth.min(), depth.max())
+    info.update(
+        depth_min=float(depth_min),
+        depth_max=float(depth_max),
+        depth_mean=float(depth.mean()),
+    )
+
+    # Percentile stretch to enhance contrast
+    vmin, vmax = fast_pct(valid, vmin_pct, vmax_pct)
+
+    # Stretch + colormap; alpha 0 where no flood, 255 where flooded
+    if arr.dtype == np.uint8:
+        # Quantized codes: one gather through a per-raster 256-entry table
+        rgba = code_lut(vmin, vmax, nodata)[arr]
+    else:
+        # Float depths: fused kernel, one sweep over the raster
+        rgba = np.empty(arr.shape + (4,), dtype=np.uint8)
+        stretch_colorize(arr, vmin, vmax, nodata, TURBO_LUT, rgba)
+
+    return rgba, bounds, info